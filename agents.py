@@ -3,8 +3,13 @@ from dotenv import load_dotenv
 load_dotenv()
 
 from crewai import Agent, LLM
-from tools import ReadBloodReportTool, NutritionAnalysisTool, ExercisePlanningTool
-from crewai_tools import SerperDevTool
+from tools import ReadBloodReportTool, NutritionAnalysisTool, ExercisePlanningTool, CachedSearchTool
+
+__all__ = [
+    "llm",
+    "blood_tool", "search_tool", "nutrition_tool", "exercise_tool",
+    "doctor", "verifier", "nutritionist", "exercise_specialist",
+]
 
 # Instantiate LLM
 llm = LLM(
@@ -16,7 +21,7 @@ llm = LLM(
 
 # Instantiate tools
 blood_tool = ReadBloodReportTool()
-search_tool = SerperDevTool()
+search_tool = CachedSearchTool()
 nutrition_tool = NutritionAnalysisTool()
 exercise_tool = ExercisePlanningTool()
 
@@ -33,7 +38,7 @@ doctor = Agent(
     Your interpretations are always grounded in evidence-based medicine, and you prioritize patient safety by providing clear, actionable insights. 
     You are committed to continuous learning and stay updated on the latest medical research to ensure your analyses are current and accurate.
     """,
-    tools=[blood_tool, search_tool],
+    tools=[search_tool],
     llm=llm,
     max_iter=3,
     verbose=True
@@ -1,24 +1,62 @@
 import os
+import time
 import uuid
 import logging
 import asyncio
-import json
-from contextlib import asynccontextmanager
-from fastapi import FastAPI, File, UploadFile, Form, HTTPException, BackgroundTasks
-import aiofiles
+import itertools
+import concurrent.futures
+from pathlib import Path
+from contextlib import asynccontextmanager, suppress
+import orjson
+from fastapi import FastAPI, File, UploadFile, Form, HTTPException, BackgroundTasks, Request
+from fastapi.responses import JSONResponse, StreamingResponse
 from crewai import Crew  # no Process import
 from agents import doctor, verifier, nutritionist, exercise_specialist
 from task import verification, help_patients, nutrition_analysis, exercise_planning
+from tools import shutdown_pdf_pool
 
 # Configuration
 data_dir = os.getenv("DATA_DIR", "data")
 output_dir = os.getenv("OUTPUT_DIR", "output")
+MAX_UPLOAD_SIZE = 10_000_000
+UPLOAD_CHUNK_SIZE = 1 << 16
+# Allowance for multipart boundaries, headers and the query form field
+MAX_REQUEST_SIZE = MAX_UPLOAD_SIZE + (1 << 20)
+CREW_MAX_WORKERS = int(os.getenv("CREW_MAX_WORKERS", "8"))
+UPLOAD_MAX_AGE = 3600
+CLEANUP_INTERVAL = 600
+
+# Thread pool backing the crew scheduler workers, bounded by this worker
+# process's share of the LLM concurrency budget
+CREW_EXECUTOR = concurrent.futures.ThreadPoolExecutor(
+    max_workers=CREW_MAX_WORKERS, thread_name_prefix="crew"
+)
 
 # Ensure directories exist
 def ensure_directories():
     os.makedirs(data_dir, exist_ok=True)
     os.makedirs(output_dir, exist_ok=True)
 
+# Remove uploads orphaned by crashes or killed workers
+def remove_stale_uploads(max_age: float = UPLOAD_MAX_AGE):
+    cutoff = time.time() - max_age
+    with os.scandir(data_dir) as entries:
+        for entry in entries:
+            if not entry.name.startswith("upload_"):
+                continue
+            # Another worker may sweep the same file between scandir and stat
+            with suppress(FileNotFoundError):
+                if entry.is_file() and entry.stat().st_mtime < cutoff:
+                    os.unlink(entry.path)
+
+async def cleanup_stale_uploads():
+    while True:
+        try:
+            await asyncio.to_thread(remove_stale_uploads)
+        except Exception:
+            logger.exception("Stale upload cleanup failed")
+        await asyncio.sleep(CLEANUP_INTERVAL)
+
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -28,7 +66,15 @@ logger = logging.getLogger(__name__)
 async def lifespan(app: FastAPI):
     # Create required directories once before serving
     await asyncio.to_thread(ensure_directories)
+    crew_scheduler.start()
+    cleanup = asyncio.create_task(cleanup_stale_uploads())
     yield
+    cleanup.cancel()
+    with suppress(asyncio.CancelledError):
+        await cleanup
+    await crew_scheduler.stop()
+    CREW_EXECUTOR.shutdown(wait=False, cancel_futures=True)
+    shutdown_pdf_pool()
 
 # Initialize FastAPI with lifespan
 app = FastAPI(
@@ -36,49 +82,137 @@ app = FastAPI(
     lifespan=lifespan
 )
 
+# Reject oversized bodies from Content-Length before the multipart upload is read
+@app.middleware("http")
+async def limit_request_size(request: Request, call_next):
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > MAX_REQUEST_SIZE:
+        return JSONResponse(status_code=413, content={"detail": "File too large"})
+    return await call_next(request)
+
+# Helper: copy an upload to disk in chunks, enforcing the size limit
+def _write_upload(src, path: str) -> int:
+    total = 0
+    try:
+        with open(path, 'wb') as out_file:
+            while chunk := src.read(UPLOAD_CHUNK_SIZE):
+                total += len(chunk)
+                if total > MAX_UPLOAD_SIZE:
+                    raise HTTPException(status_code=413, detail="File too large")
+                out_file.write(chunk)
+    except HTTPException:
+        os.remove(path)
+        raise
+    return total
+
 # Helper: create a crew
-def make_crew(agents, tasks, parallel=False):
+def make_crew(agents, tasks):
     return Crew(
         agents=agents,
         tasks=tasks,
         verbose=True
     )
 
-# Helper: run crew offloaded to thread
-def kickoff_threaded(crew, payload: dict):
-    return crew.kickoff(payload)
+# Helper: structured, JSON-friendly view of a finished crew run. Task outputs
+# are read from the crew's own tasks: CrewOutput.tasks_output drops tasks that
+# ran before an async batch, and concurrent tasks land in completion order.
+def serialize_crew_output(crew, response) -> dict:
+    return {
+        "raw": response.raw,
+        "tasks": [
+            {"name": task.name, "raw": task.output.raw, "json": task.output.to_dict() or None}
+            for task in crew.tasks
+        ],
+        "tokens": response.token_usage.model_dump()
+    }
+
+# Helper: run a private copy of the crew offloaded to thread
+def kickoff_threaded(crew, payload: dict, task_callback=None):
+    # Crew.kickoff interpolates inputs into its tasks in place, so each run
+    # works on its own copy, as Crew.kickoff_for_each does
+    crew = crew.copy()
+    if task_callback:
+        crew.task_callback = task_callback
+    response = crew.kickoff(payload)
+    return serialize_crew_output(crew, response)
+
+# Priority scheduler: a fixed set of workers pulls crew runs in
+# (priority, arrival) order, so short endpoints are not starved behind long
+# ones. Lower values run first.
+PRIORITY_VERIFY = 0
+PRIORITY_MEDICAL = 1
+PRIORITY_ANALYZE = 2
+
+class CrewScheduler:
+    def __init__(self, workers: int = CREW_MAX_WORKERS):
+        self.workers = workers
+        self.queue: asyncio.PriorityQueue = asyncio.PriorityQueue()
+        self._seq = itertools.count()
+        self._workers = []
+
+    def start(self):
+        self._workers = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+
+    async def submit(self, priority: int, crew, payload: dict, task_callback=None):
+        future = asyncio.get_running_loop().create_future()
+        # The sequence number keeps FIFO order within a priority level
+        self.queue.put_nowait((priority, next(self._seq), crew, payload, task_callback, future))
+        return await future
+
+    async def _work(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            _, _, crew, payload, task_callback, future = await self.queue.get()
+            if future.done():  # caller went away while queued
+                continue
+            try:
+                result = await loop.run_in_executor(CREW_EXECUTOR, kickoff_threaded, crew, payload, task_callback)
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+            else:
+                if not future.done():
+                    future.set_result(result)
+
+crew_scheduler = CrewScheduler()
+
+# Long-lived crews, one per endpoint; each run kicks off a copy
+full_crew = make_crew(
+    [verifier, doctor, nutritionist, exercise_specialist],
+    [verification, help_patients, nutrition_analysis, exercise_planning]
+)
+verification_crew = make_crew([verifier], [verification])
+medical_crew = make_crew([verifier, doctor], [verification, help_patients])
 
 # Core runners
-def run_crew(query: str, file_path: str):
+async def run_crew(query: str, file_path: str, task_callback=None):
     logger.info(f"Running full crew on {file_path}")
-    crew = make_crew(
-        agents=[verifier, doctor, nutritionist, exercise_specialist],
-        tasks=[verification, help_patients, nutrition_analysis, exercise_planning],
-        parallel=True
-    )
-    return asyncio.get_event_loop().run_in_executor(
-        None, kickoff_threaded, crew, {"query": query, "file_path": file_path}
+    return await crew_scheduler.submit(
+        PRIORITY_ANALYZE, full_crew, {"query": query, "file_path": file_path}, task_callback
     )
 
-def run_verification_only(query: str, file_path: str):
+async def run_verification_only(query: str, file_path: str):
     logger.info(f"Running verification only on {file_path}")
-    crew = make_crew([verifier], [verification])
-    return asyncio.get_event_loop().run_in_executor(
-        None, kickoff_threaded, crew, {"query": query, "file_path": file_path}
+    return await crew_scheduler.submit(
+        PRIORITY_VERIFY, verification_crew, {"query": query, "file_path": file_path}
     )
 
-def run_medical_analysis_only(query: str, file_path: str):
+async def run_medical_analysis_only(query: str, file_path: str):
     logger.info(f"Running medical analysis on {file_path}")
-    crew = make_crew([verifier, doctor], [verification, help_patients])
-    return asyncio.get_event_loop().run_in_executor(
-        None, kickoff_threaded, crew, {"query": query, "file_path": file_path}
+    return await crew_scheduler.submit(
+        PRIORITY_MEDICAL, medical_crew, {"query": query, "file_path": file_path}
     )
 
 # Utility: save result
 async def save_result(file_id: str, result: dict):
     output_path = os.path.join(output_dir, f"result_{file_id}.json")
-    async with aiofiles.open(output_path, 'w') as f:
-        await f.write(json.dumps(result, indent=2))
+    data = orjson.dumps(result, option=orjson.OPT_INDENT_2)
+    await asyncio.to_thread(Path(output_path).write_bytes, data)
     return output_path
 
 # Endpoints
@@ -86,6 +220,20 @@ async def save_result(file_id: str, result: dict):
 async def root():
     return {"message": "Blood Test Report Analyser API is running"}
 
+async def save_upload(file: UploadFile):
+    # Size is known up front for most clients; the chunked copy covers the rest
+    if file.size and file.size > MAX_UPLOAD_SIZE:
+        raise HTTPException(status_code=413, detail="File too large")
+
+    file_id = str(uuid.uuid4())
+    filename = file.filename or "uploaded_file.pdf"
+    ext = os.path.splitext(filename)[1] or ".pdf"
+    temp_path = os.path.join(data_dir, f"upload_{file_id}{ext}")
+
+    # Save upload in a single worker-thread hop
+    await asyncio.to_thread(_write_upload, file.file, temp_path)
+    return file_id, temp_path
+
 async def process_file_and_run(
     file: UploadFile,
     query: str,
@@ -93,56 +241,89 @@ async def process_file_and_run(
     background_tasks: BackgroundTasks,
     default_query: str
 ):
-    file_id = str(uuid.uuid4())
-    filename = file.filename or "uploaded_file.pdf"
-    ext = os.path.splitext(filename)[1] or ".pdf"
-    temp_path = os.path.join(data_dir, f"upload_{file_id}{ext}")
-
-    # Save upload asynchronously
-    async with aiofiles.open(temp_path, 'wb') as out_file:
-        content = await file.read()
-        if len(content) > 10_000_000:
-            raise HTTPException(status_code=413, detail="File too large")
-        await out_file.write(content)
+    file_id, temp_path = await save_upload(file)
 
     if not query:
         query = default_query
     query = query.strip()
 
-    # Run the specified crew
+    # Run the specified crew, removing the upload whether or not it succeeds
     try:
-        response = await runner(query, temp_path)
+        analysis = await runner(query, temp_path)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        await asyncio.to_thread(os.unlink, temp_path)
 
     # Build standardized result object
     result_obj = {
         "file_id": file_id,
         "original_filename": file.filename,
         "query": query,
-        "analysis": repr(response)
+        "analysis": analysis
     }
 
     # Save result in background
     background_tasks.add_task(save_result, file_id, result_obj)
 
-    # Cleanup upload
-    os.remove(temp_path)
-
     return result_obj
 
+# Stream one NDJSON line per finished task, then the full result
+async def stream_crew_run(
+    file_id: str,
+    filename: str,
+    query: str,
+    temp_path: str,
+    runner,
+    background_tasks: BackgroundTasks
+):
+    loop = asyncio.get_running_loop()
+    updates: asyncio.Queue = asyncio.Queue()
+
+    # Task callbacks fire on crew worker threads
+    def on_task(output):
+        loop.call_soon_threadsafe(updates.put_nowait, output)
+
+    run = asyncio.ensure_future(runner(query, temp_path, on_task))
+    run.add_done_callback(lambda _: updates.put_nowait(None))
+    try:
+        while (output := await updates.get()) is not None:
+            yield orjson.dumps({"stage": output.name, "result": output.raw}) + b"\n"
+
+        try:
+            analysis = run.result()
+        except Exception as e:
+            yield orjson.dumps({"stage": "error", "detail": str(e)}) + b"\n"
+            return
+
+        result_obj = {
+            "file_id": file_id,
+            "original_filename": filename,
+            "query": query,
+            "analysis": analysis
+        }
+        # Runs once the streamed response has been fully sent
+        background_tasks.add_task(save_result, file_id, result_obj)
+        yield orjson.dumps({"stage": "complete", **result_obj}) + b"\n"
+    finally:
+        run.cancel()
+        await asyncio.to_thread(os.unlink, temp_path)
+
 @app.post("/analyze")
 async def analyze(
     background_tasks: BackgroundTasks,
     file: UploadFile = File(...),
     query: str = Form(default="Provide a comprehensive analysis of my blood test report including medical interpretation, nutritional recommendations, and exercise planning.")
 ):
-    return await process_file_and_run(
-        file,
-        query,
-        run_crew,
-        background_tasks,
-        default_query="Provide a comprehensive analysis of my blood test report including medical interpretation, nutritional recommendations, and exercise planning."
+    file_id, temp_path = await save_upload(file)
+
+    if not query:
+        query = "Provide a comprehensive analysis of my blood test report including medical interpretation, nutritional recommendations, and exercise planning."
+    query = query.strip()
+
+    return StreamingResponse(
+        stream_crew_run(file_id, file.filename, query, temp_path, run_crew, background_tasks),
+        media_type="application/x-ndjson"
     )
 
 @app.post("/verify")
@@ -183,9 +364,3 @@ async def health_check():
         "data_dir": data_dir,
         "output_dir": output_dir
     }
-
-if __name__ == "__main__":
-    import uvicorn
-    ensure_directories()
-    uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
-
@@ -0,0 +1,7 @@
+# Runs inside the PDF worker processes, so it imports only pymupdf to keep
+# their start-up cheap
+import pymupdf
+
+def extract_text(file_path: str) -> str:
+    with pymupdf.open(file_path) as doc:
+        return "\n".join(page.get_text() for page in doc)
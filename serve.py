@@ -0,0 +1,18 @@
+# Entry point kept separate from main.py: the PDF pool spawns its workers by
+# re-importing __main__, and they must not import the app, CrewAI and the crews
+import os
+
+if __name__ == "__main__":
+    import uvicorn
+    # Reload (single process, file watcher) only for local development
+    dev = os.getenv("ENV") == "dev"
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=8000,
+        loop="uvloop",
+        http="httptools",
+        reload=dev,
+        # CREW_MAX_WORKERS, the priority queue and the caches are per process
+        workers=None if dev else int(os.getenv("WEB_CONCURRENCY", "1"))
+    )
@@ -1,20 +1,32 @@
 import asyncio
 import os
-from typing import Dict, Any
+from typing import Dict, Any, List, Optional
 
 from crewai import Task
-from tools import ReadBloodReportTool, NutritionAnalysisTool, ExercisePlanningTool
-from crewai_tools import SerperDevTool
-from agents import doctor, verifier, nutritionist, exercise_specialist
+from pydantic import BaseModel, Field
+# Share the agents' tool instances so agents and tasks see the same tools
+from agents import (
+    doctor, verifier, nutritionist, exercise_specialist,
+    blood_tool, search_tool, nutrition_tool, exercise_tool,
+)
+
+# Structured verification output. Downstream tasks receive this JSON through
+# context instead of re-reading the full report text.
+class Biomarker(BaseModel):
+    value: Optional[float] = Field(None, description="Measured value, or null if not numeric")
+    unit: Optional[str] = Field(None, description="Unit as printed on the report")
+    ref_low: Optional[float] = Field(None, description="Lower bound of the reference range")
+    ref_high: Optional[float] = Field(None, description="Upper bound of the reference range")
 
-# Instantiate tools
-blood_tool = ReadBloodReportTool()
-search_tool = SerperDevTool()
-nutrition_tool = NutritionAnalysisTool()
-exercise_tool = ExercisePlanningTool()
+class BloodReportVerification(BaseModel):
+    is_blood_report: bool = Field(..., description="Whether the document is a blood test report")
+    biomarkers: Dict[str, Biomarker] = Field(default_factory=dict, description="Biomarkers keyed by name")
+    abnormal: List[str] = Field(default_factory=list, description="Names of biomarkers outside their reference range")
+    summary: str = Field(..., description="Short summary of findings, including a disclaimer to consult a healthcare professional")
 
 # Task 1: Blood Report Verification and Analysis
 verification = Task(
+    name="verification",
     description="""
     Carefully analyze the uploaded document located at {file_path} using the ReadBloodReportTool to verify if it's a valid blood test report.
     
@@ -31,26 +43,27 @@ verification = Task(
     Always include appropriate medical disclaimers about consulting healthcare professionals.
     """,
     expected_output="""
-    Provide a structured analysis including:
-    - Document verification status (confirmed blood report: yes/no)
-    - List of detected biomarkers with values and reference ranges
-    - Identification of any abnormal values (high/low/critical)
-    - Brief explanation of what abnormal values might indicate
-    - Clear disclaimer about consulting healthcare professionals
-    - Recommendation for follow-up if any critical values are found
+    A JSON object with:
+    - is_blood_report: document verification status (true/false)
+    - biomarkers: every detected biomarker keyed by name, each with value, unit, ref_low and ref_high
+    - abnormal: names of biomarkers outside their reference range
+    - summary: brief explanation of what abnormal values might indicate, a recommendation for follow-up
+      if any critical values are found, and a clear disclaimer about consulting healthcare professionals
     """,
     agent=verifier,
     tools=[blood_tool],
+    output_pydantic=BloodReportVerification,
     async_execution=False,
 )
 
 # Task 2: Medical Analysis and Interpretation
 help_patients = Task(
+    name="help_patients",
     description="""
-    Based on the verified blood report data from {file_path}, provide a comprehensive medical analysis.
+    Based on the verified blood report data, provide a comprehensive medical analysis.
     
     Your responsibilities:
-    1. Use the ReadBloodReportTool with the file path {file_path} to access the blood test data.
+    1. Use the verified biomarkers JSON provided in your context as the blood test data.
     2. Interpret the clinical significance of abnormal values.
     3. Look for patterns that might suggest specific conditions.
     4. Research current medical literature for context.
@@ -59,7 +72,7 @@ help_patients = Task(
     User query: {query}
     
     Guidelines:
-    - Base analysis only on verified blood test data extracted using ReadBloodReportTool.
+    - Base analysis only on the verified biomarkers from the verification step.
     - Use peer-reviewed medical sources for interpretations.
     - Clearly distinguish between different levels of concern.
     - Always emphasize the need for professional medical consultation.
@@ -74,17 +87,20 @@ help_patients = Task(
     - Strong emphasis on consulting healthcare professionals for diagnosis
     """,
     agent=doctor,
-    tools=[blood_tool, search_tool],
-    async_execution=False,
+    tools=[search_tool],
+    context=[verification],
+    async_execution=True,
 )
 
 # Task 3: Nutritional Recommendations
 nutrition_analysis = Task(
+    name="nutrition_analysis",
     description="""
-    Based on the blood test results from {file_path}, provide evidence-based nutritional recommendations.
+    Based on the verified blood test results, provide evidence-based nutritional recommendations.
     
     Your responsibilities:
-    1. Use the ReadBloodReportTool with the file path {file_path} to access blood metrics.
+    1. Use the verified biomarkers JSON provided in your context as the blood metrics.
+       When using the nutrition tool, pass the biomarkers as "Name: value" lines.
     2. Identify nutritional deficiencies or excesses indicated by blood markers.
     3. Research nutritional interventions supported by scientific evidence.
     4. Provide practical dietary recommendations.
@@ -109,17 +125,20 @@ nutrition_analysis = Task(
     - References to nutritional research and guidelines
     """,
     agent=nutritionist,
-    tools=[blood_tool, nutrition_tool, search_tool],
-    async_execution=False,
+    tools=[nutrition_tool, search_tool],
+    context=[verification],
+    async_execution=True,
 )
 
 # Task 4: Exercise and Lifestyle Recommendations
 exercise_planning = Task(
+    name="exercise_planning",
     description="""
-    Create safe, personalized exercise recommendations based on blood test findings from {file_path}.
+    Create safe, personalized exercise recommendations based on the verified blood test findings.
     
     Your responsibilities:
-    1. Use the ReadBloodReportTool with the file path {file_path} to access blood metrics.
+    1. Use the verified biomarkers JSON provided in your context as the blood metrics.
+       When using the exercise planning tool, pass the biomarkers as "Name: value" lines.
     2. Assess cardiovascular risk factors from blood work.
     3. Consider any metabolic indicators that affect exercise capacity.
     4. Provide graduated exercise recommendations.
@@ -145,6 +164,11 @@ exercise_planning = Task(
     - Modifications based on specific health markers
     """,
     agent=exercise_specialist,
-    tools=[blood_tool, exercise_tool, search_tool],
+    tools=[exercise_tool, search_tool],
+    context=[verification],
+    # CrewAI requires a crew to end with at most one async task, so this one
+    # stays synchronous. CrewAI waits for pending async tasks before running a
+    # sync one, so the order is verification -> {doctor, nutrition} -> exercise,
+    # even though its context is only the verification output.
     async_execution=False,
 )
\ No newline at end of file
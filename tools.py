@@ -1,10 +1,66 @@
 import re
 import os
-from typing import Dict, Optional, Any, Type
-from langchain_community.document_loaders import PyPDFLoader
+import asyncio
+import functools
+import threading
+import multiprocessing
+import concurrent.futures
+from typing import Dict, List, Optional, Any, Type, Union
+from cachetools import TTLCache
 from crewai.tools import BaseTool
+from crewai_tools import SerperDevTool
 from pydantic import BaseModel, Field
-import time
+from pdf_extract import extract_text
+
+# CPU-bound PDF parsing runs in worker processes so concurrent reports parse
+# in parallel instead of contending for the GIL. Spawn avoids forking a
+# process that already has crew threads running. The pool is created on first
+# use and kept small: each web worker gets its own.
+PDF_MAX_WORKERS = int(os.getenv("PDF_MAX_WORKERS", "2"))
+_pdf_pool: Optional[concurrent.futures.ProcessPoolExecutor] = None
+_pdf_pool_lock = threading.Lock()
+
+def get_pdf_pool() -> concurrent.futures.ProcessPoolExecutor:
+    global _pdf_pool
+    with _pdf_pool_lock:
+        if _pdf_pool is None:
+            _pdf_pool = concurrent.futures.ProcessPoolExecutor(
+                max_workers=PDF_MAX_WORKERS,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return _pdf_pool
+
+def shutdown_pdf_pool():
+    global _pdf_pool
+    with _pdf_pool_lock:
+        if _pdf_pool is not None:
+            _pdf_pool.shutdown(wait=False, cancel_futures=True)
+            _pdf_pool = None
+
+def _discard_pdf_pool(pool: concurrent.futures.ProcessPoolExecutor):
+    # Only drop the pool that broke; another thread may already have replaced it
+    global _pdf_pool
+    with _pdf_pool_lock:
+        if _pdf_pool is pool:
+            _pdf_pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+def _extract_pdf_text(file_path: str) -> str:
+    # A worker dying (OOM, segfault in a malformed PDF) breaks the whole pool,
+    # so swap in a fresh one and retry once before failing this upload
+    for attempt in range(2):
+        pool = get_pdf_pool()
+        try:
+            return pool.submit(extract_text, file_path).result()
+        except concurrent.futures.process.BrokenProcessPool:
+            _discard_pdf_pool(pool)
+            if attempt:
+                raise
+
+@functools.lru_cache(maxsize=128)
+def _load_pdf_cached(file_path: str, mtime_ns: int, size: int) -> str:
+    # mtime/size are part of the key so a rewritten file is re-parsed
+    return _extract_pdf_text(file_path)
 
 class ReadBloodReportInputSchema(BaseModel):
     file_path: str = Field(..., description="Path to the PDF file")
@@ -18,35 +74,43 @@ class ReadBloodReportTool(BaseTool):
         # Convert to absolute path if not already
         file_path = os.path.abspath(file_path)
         
-        # Retry logic for file access
-        max_attempts = 3
-        for attempt in range(max_attempts):
-            if os.path.isfile(file_path):
-                break
-            # logger.warning(f"File not found on attempt {attempt + 1}: {file_path}")
-            time.sleep(1)  # Wait before retrying
-        else:
-            raise FileNotFoundError(f"File not found after {max_attempts} attempts: {file_path}")
+        if not os.path.isfile(file_path):
+            raise FileNotFoundError(f"File not found: {file_path}")
         
         if not file_path.lower().endswith('.pdf'):
             raise ValueError("File must be a PDF")
         
         try:
-            loader = PyPDFLoader(file_path)
-            docs = loader.load()
-            full_text = "\n".join(doc.page_content for doc in docs)
-            return full_text
+            st = os.stat(file_path)
+            return _load_pdf_cached(file_path, st.st_mtime_ns, st.st_size)
         except Exception as e:
             raise ValueError(f"Error reading PDF file: {str(e)}")
 
     async def _arun(self, file_path: str) -> str:
-        return self._run(file_path)
+        return await asyncio.to_thread(self._run, file_path)
+
+# -----------------------------
+# Marker extraction shared by the analysis tools
+# -----------------------------
+_MARKERS = ("Hemoglobin", "Cholesterol")
+_MARKER_PATTERN = re.compile(rf"({'|'.join(_MARKERS)})[:\s]*([\d\.]+)", re.IGNORECASE)
+
+@functools.lru_cache(maxsize=128)
+def _extract_markers(blood_text: str) -> Dict[str, float]:
+    # Single pass over the text; keep the first value seen for each marker.
+    # Memoized so both tools share one scan per report; callers must not mutate.
+    findings: Dict[str, float] = {}
+    for match in _MARKER_PATTERN.finditer(blood_text):
+        marker = match.group(1).capitalize()
+        if marker not in findings:
+            findings[marker] = float(match.group(2))
+    return findings
 
 # -----------------------------
 # Tool: Nutrition Analysis
 # -----------------------------
 class NutritionAnalysisInputSchema(BaseModel):
-    blood_text: str = Field(..., description="Extracted text from a blood report")
+    blood_text: str = Field(..., description="Blood report text, or biomarkers as 'Name: value' lines")
 
 class NutritionAnalysisTool(BaseTool):
     name: str = "nutrition_analysis"
@@ -59,12 +123,7 @@ class NutritionAnalysisTool(BaseTool):
             "Cholesterol": (125, 200),   # mg/dL
         }
 
-        findings = {}
-        for marker, (low, high) in reference_ranges.items():
-            pattern = rf"{marker}[:\s]*([\d\.]+)"
-            match = re.search(pattern, blood_text, re.IGNORECASE)
-            if match:
-                findings[marker] = float(match.group(1))
+        findings = _extract_markers(blood_text)
 
         advice_lines = []
         for marker, value in findings.items():
@@ -93,7 +152,7 @@ class NutritionAnalysisTool(BaseTool):
 # Tool: Exercise Planning
 # -----------------------------
 class ExercisePlanningInputSchema(BaseModel):
-    blood_text: str = Field(..., description="Extracted text from a blood report")
+    blood_text: str = Field(..., description="Blood report text, or biomarkers as 'Name: value' lines")
 
 class ExercisePlanningTool(BaseTool):
     name: str = "exercise_planning"
@@ -102,13 +161,12 @@ class ExercisePlanningTool(BaseTool):
 
     def _run(self, blood_text: str) -> str:
         plan = []
+        findings = _extract_markers(blood_text)
 
-        chol_match = re.search(r"Cholesterol[:\s]*([\d\.]+)", blood_text, re.IGNORECASE)
-        if chol_match and float(chol_match.group(1)) > 200:
+        if findings.get("Cholesterol", 0) > 200:
             plan.append("High cholesterol detected: incorporate 30 minutes of moderate cardio (e.g., brisk walking) 5 days/week.")
 
-        hemo_match = re.search(r"Hemoglobin[:\s]*([\d\.]+)", blood_text, re.IGNORECASE)
-        if hemo_match and float(hemo_match.group(1)) < 13.5:
+        if "Hemoglobin" in findings and findings["Hemoglobin"] < 13.5:
             plan.append("Low hemoglobin detected: start with light-intensity exercises like yoga or pilates 3 days/week, gradually increasing intensity.")
 
         if not plan:
@@ -119,3 +177,65 @@ class ExercisePlanningTool(BaseTool):
     async def _arun(self, blood_text: str) -> str:
         return self._run(blood_text)
 
+# -----------------------------
+# Tool: Cached Web Search
+# -----------------------------
+# Agents repeat the same lookups across requests ("normal hemoglobin range"),
+# so Serper results are kept in memory for a day. Shared across instances and
+# crew threads, hence the lock.
+_SEARCH_CACHE: TTLCache = TTLCache(maxsize=1024, ttl=24 * 60 * 60)
+_SEARCH_CACHE_LOCK = threading.Lock()
+
+# Independent lookups requested together run concurrently, so a batch costs
+# about one round-trip instead of one per query
+_SEARCH_POOL = concurrent.futures.ThreadPoolExecutor(max_workers=8, thread_name_prefix="search")
+
+class CachedSearchInputSchema(BaseModel):
+    search_query: Union[str, List[str]] = Field(
+        ..., description="Search query, or a list of independent queries to run in parallel"
+    )
+
+class CachedSearchTool(SerperDevTool):
+    description: str = (
+        "Searches the internet. Pass search_query as a single query, or as a list of "
+        "independent queries (e.g. [\"q1\", \"q2\"]) to run them in parallel; a list "
+        "returns results keyed by query."
+    )
+    args_schema: Type[BaseModel] = CachedSearchInputSchema
+
+    @staticmethod
+    def _split_queries(kwargs: Dict[str, Any]):
+        # Pop both aliases so neither is forwarded alongside search_query
+        search_query = kwargs.pop("search_query", None)
+        query = kwargs.pop("query", None)
+        return search_query or query or "", kwargs
+
+    def _search_one(self, search_query: str, **kwargs: Any) -> Any:
+        # Saving to a file is a side effect a cache hit would skip
+        if kwargs.get("save_file", self.save_file):
+            return super()._run(**{**kwargs, "search_query": search_query})
+        # "search" and "news" results differ for the same query
+        key = (kwargs.get("search_type", self.search_type), search_query.strip().lower())
+        with _SEARCH_CACHE_LOCK:
+            if key in _SEARCH_CACHE:
+                return _SEARCH_CACHE[key]
+        result = super()._run(**{**kwargs, "search_query": search_query})
+        with _SEARCH_CACHE_LOCK:
+            _SEARCH_CACHE[key] = result
+        return result
+
+    def _run(self, **kwargs: Any) -> Any:
+        queries, kwargs = self._split_queries(kwargs)
+        if isinstance(queries, str):
+            return self._search_one(queries, **kwargs)
+        results = _SEARCH_POOL.map(lambda q: self._search_one(q, **kwargs), queries)
+        return dict(zip(queries, results))
+
+    async def _arun(self, **kwargs: Any) -> Any:
+        queries, kwargs = self._split_queries(kwargs)
+        if isinstance(queries, str):
+            return await asyncio.to_thread(self._search_one, queries, **kwargs)
+        results = await asyncio.gather(
+            *(asyncio.to_thread(self._search_one, q, **kwargs) for q in queries)
+        )
+        return dict(zip(queries, results))